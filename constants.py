@@ -4,3 +4,26 @@ YELLOW = "\033[93m"
 RED = "\033[91m"
 RESET = "\033[0m"
 GREY = "\033[90m"
+
+# Provisioning profiles
+DEFAULT_PROFILE = "default"
+EPHEMERAL_PROFILE = "ephemeral"
+PROFILES = (DEFAULT_PROFILE, EPHEMERAL_PROFILE)
+
+# dpkg options used by the ephemeral profile: skip fsync and leave out docs/man pages
+EPHEMERAL_DPKG_OPTIONS = (
+    "--force-unsafe-io",
+    "--path-exclude=/usr/share/doc/*",
+    "--path-include=/usr/share/doc/*/copyright",
+    "--path-exclude=/usr/share/man/*",
+    "--path-exclude=/usr/share/info/*",
+)
+
+# tmpfs used for cargo builds and downloads when enough RAM is available
+TMPFS_DIR = "/dev/shm"
+TMPFS_MIN_FREE_BYTES = 4 * 1024**3
+
+# Shared, content-addressed store used by multi-user provisioning
+STORE_DIR = "/opt/ubuntu-env-conf/store"
+STORE_BUILD_DIR = "/opt/ubuntu-env-conf/build"
+STORE_MANIFEST = "/opt/ubuntu-env-conf/store/manifest.json"
@@ -1,5 +1,5 @@
 #!/bin/bash
 # This script is used to run the Python script with the specified arguments.
 
-python3 script.py
+python3 script.py "$@"
 python3 tests.py
\ No newline at end of file
@@ -1,8 +1,11 @@
+import argparse
 import os
+import pwd
 import re
 import subprocess
 import sys
 import shutil
+import time
 
 from constants import (
     GREEN,
@@ -10,11 +13,65 @@ from constants import (
     RED,
     YELLOW,
     RESET,
+    DEFAULT_PROFILE,
+    EPHEMERAL_PROFILE,
+    PROFILES,
+    EPHEMERAL_DPKG_OPTIONS,
+    TMPFS_DIR,
+    TMPFS_MIN_FREE_BYTES,
+    STORE_BUILD_DIR,
 )
-from utils import logg, run_command, get_user_home
-
-
-def clone_repo(repo_url, dest):
+from utils import (
+    logg,
+    run_command,
+    run_pipeline,
+    get_user_home,
+    set_user_home,
+    get_tmpfs_dir,
+    run_as_user,
+    load_timings,
+    save_timings,
+)
+from store import add_to_store, get_component, link_path, link_tree
+
+# Active provisioning profile and directory used for downloads and extraction.
+# Both are set by configure_profile() before any step runs.
+PROFILE = DEFAULT_PROFILE
+STAGING_DIR = "/tmp"
+
+# Users provisioned from the shared store (--users); empty for a single-user run.
+USERS = []
+# Users from USERS that provision_users() could not provision
+FAILED_USERS = []
+
+# Marks the store settings block that provision_users() keeps in shell startup files
+STORE_BLOCK_BEGIN = "# >>> ubuntu-env-conf shared store >>>"
+STORE_BLOCK_END = "# <<< ubuntu-env-conf shared store <<<"
+
+# Store components and the files each must contain for a build to be kept
+STORE_COMPONENTS = {
+    "oh-my-zsh": [
+        "oh-my-zsh.sh",
+        os.path.join("templates", "zshrc.zsh-template"),
+        os.path.join("custom", "plugins", "zsh-autosuggestions", "zsh-autosuggestions.zsh"),
+        os.path.join(
+            "custom", "plugins", "zsh-syntax-highlighting", "zsh-syntax-highlighting.zsh"
+        ),
+        os.path.join("custom", "themes", "powerlevel10k", "powerlevel10k.zsh-theme"),
+    ],
+    "fonts": [
+        "MesloLGS NF Regular.ttf",
+        "MesloLGS NF Bold.ttf",
+        "MesloLGS NF Italic.ttf",
+        "MesloLGS NF Bold Italic.ttf",
+        "JetBrainsMono-Regular.ttf",
+    ],
+    "rustup": ["settings.toml", "toolchains"],
+    "cargo-bin": ["cargo", "rustc", "rustup", "exa", "bat", "uv"],
+}
+
+
+def clone_repo(repo_url, dest, depth=None):
     """
     Clone a git repository to the destination directory only if not already present.
     """
@@ -23,18 +80,68 @@ def clone_repo(repo_url, dest):
         return
     logg(f"Starting clone of repository {repo_url} to {dest}...", BLUE)
     try:
-        run_command(f"git clone {repo_url} {dest}")
+        argv = ["git", "clone", repo_url, dest]
+        if depth:
+            argv.append(f"--depth={depth}")
+        run_command(argv)
         logg(f"Repository cloned to {dest}.", GREEN)
     except Exception as e:
         logg(f"Error cloning repository {repo_url}: {e}", RED)
 
 
+def configure_profile(profile):
+    """
+    Apply the settings of the given provisioning profile.
+
+    The ephemeral profile trades crash safety for speed: dpkg skips fsync and
+    documentation, and cargo builds and downloads go to tmpfs when enough RAM
+    is free.
+    """
+    global PROFILE, STAGING_DIR
+    PROFILE = profile
+    logg(f"Using provisioning profile '{profile}'.", BLUE)
+    if profile != EPHEMERAL_PROFILE:
+        return
+    tmpfs = get_tmpfs_dir(TMPFS_DIR, TMPFS_MIN_FREE_BYTES)
+    if not tmpfs:
+        logg("Not enough free RAM for tmpfs staging. Using /tmp instead.", YELLOW)
+        return
+    STAGING_DIR = os.path.join(tmpfs, "ubuntu-env-conf")
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    os.environ["CARGO_TARGET_DIR"] = os.path.join(STAGING_DIR, "cargo-target")
+    logg(f"Staging downloads and cargo builds in {STAGING_DIR}.", BLUE)
+
+
+def cleanup_staging():
+    """
+    Remove the tmpfs staging directory so its RAM is released once the run ends.
+    """
+    if not STAGING_DIR.startswith(TMPFS_DIR):
+        return
+    logg(f"Removing staging directory {STAGING_DIR}...", BLUE)
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+
+
+def apt_install(packages):
+    """
+    Install apt packages, passing the dpkg options of the active profile.
+    """
+    argv = ["apt", "install", "-y"]
+    if PROFILE == EPHEMERAL_PROFILE:
+        for option in EPHEMERAL_DPKG_OPTIONS:
+            argv += ["-o", f"Dpkg::Options::={option}"]
+    run_command(argv + list(packages), privileged=True)
+
+
 def update_upgrade():
     logg("Starting update and upgrade of packages...", BLUE)
     try:
         # Check if apt update/upgrade are needed (could parse output, for now always run)
-        run_command("apt update -y")
-        run_command("apt upgrade -y")
+        run_command(["apt", "update", "-y"], privileged=True)
+        if PROFILE == EPHEMERAL_PROFILE:
+            logg("Skipping apt upgrade for the ephemeral profile.", YELLOW)
+            return
+        run_command(["apt", "upgrade", "-y"], privileged=True)
         logg("Packages updated and upgraded successfully.", GREEN)
     except Exception as e:
         logg(f"Error during update/upgrade: {e}", RED)
@@ -42,14 +149,28 @@ def update_upgrade():
 
 def install_packages():
     logg("Starting installation of essential packages...", BLUE)
-    apt_packages = (
-        "build-essential curl libbz2-dev libffi-dev liblzma-dev libncursesw5-dev "
-        "libreadline-dev libsqlite3-dev libssl-dev libxml2-dev libxmlsec1-dev llvm "
-        "make tk-dev wget xz-utils zlib1g-dev"
-    )
+    apt_packages = [
+        "build-essential",
+        "curl",
+        "libbz2-dev",
+        "libffi-dev",
+        "liblzma-dev",
+        "libncursesw5-dev",
+        "libreadline-dev",
+        "libsqlite3-dev",
+        "libssl-dev",
+        "libxml2-dev",
+        "libxmlsec1-dev",
+        "llvm",
+        "make",
+        "tk-dev",
+        "wget",
+        "xz-utils",
+        "zlib1g-dev",
+    ]
     try:
         # We could check if dpkg -l shows these packages but here we assume idempotence
-        run_command(f"apt install -y {apt_packages}")
+        apt_install(apt_packages)
         logg("Essential packages installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing essential packages: {e}", RED)
@@ -58,7 +179,7 @@ def install_packages():
 def install_basic_tools():
     logg("Starting installation of basic tools...", BLUE)
     try:
-        run_command("apt install -y zsh git wget curl unzip")
+        apt_install(["zsh", "git", "wget", "curl", "unzip"])
         logg("Basic tools installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing basic tools: {e}", RED)
@@ -73,8 +194,7 @@ def change_default_shell():
             logg("Default shell is already zsh. Skipping change.", YELLOW)
             return
         subprocess.run(
-            "chsh -s $(which zsh)",
-            shell=True,
+            ["chsh", "-s", shutil.which("zsh")],
             check=True,
             timeout=10,
             stdout=subprocess.DEVNULL,
@@ -108,8 +228,20 @@ def install_oh_my_zsh():
         env = os.environ.copy()
         env["RUNZSH"] = "no"
         env["CHSH"] = "no"
-        run_command(
-            'sh -c "$(curl -fsSL https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh)"',
+        # Install into the target home (the store build home, or SUDO_USER's
+        # home) rather than $HOME, matching the check above and the plugin and
+        # theme steps that write to get_user_home()/.oh-my-zsh
+        env["ZSH"] = ohmyzsh_dir
+        env["ZDOTDIR"] = home
+        run_pipeline(
+            [
+                [
+                    "curl",
+                    "-fsSL",
+                    "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh",
+                ],
+                ["sh", "-s"],
+            ],
             env=env,
         )
         logg("Oh My Zsh installed successfully.", GREEN)
@@ -135,7 +267,7 @@ def install_zsh_plugins():
                 logg(f"Plugin '{name}' already installed. Skipping.", YELLOW)
             else:
                 try:
-                    run_command(f"git clone {repo_url} {dest}")
+                    run_command(["git", "clone", repo_url, dest])
                     logg(f"Plugin '{name}' installed successfully.", GREEN)
                 except Exception as e:
                     logg(f"Error cloning plugin '{name}': {e}", RED)
@@ -155,7 +287,7 @@ def install_powerlevel10k():
         if os.path.exists(dest) and os.listdir(dest):
             logg("Powerlevel10k is already installed. Skipping.", YELLOW)
         else:
-            clone_repo("https://github.com/romkatv/powerlevel10k.git --depth=1", dest)
+            clone_repo("https://github.com/romkatv/powerlevel10k.git", dest, depth=1)
         logg("Powerlevel10k installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing Powerlevel10k: {e}", RED)
@@ -179,25 +311,25 @@ def install_fonts():
             if os.path.exists(dest_file):
                 logg(f"Font '{filename}' already installed. Skipping.", YELLOW)
             else:
-                run_command(f'wget -O "{dest_file}" "{url}"')
+                run_command(["wget", "-O", dest_file, url])
                 logg(f"Font '{filename}' downloaded successfully.", GREEN)
-        run_command("fc-cache -fv")
+        run_command(["fc-cache", "-fv"])
         logg("Font cache updated for Nerd Fonts.", GREEN)
 
         # Install JetBrains Mono font
-        jetbrains_zip = os.path.join("/tmp", "jetbrains-mono.zip")
+        jetbrains_zip = os.path.join(STAGING_DIR, "jetbrains-mono.zip")
         jetbrains_url = "https://download.jetbrains.com/fonts/JetBrainsMono-2.242.zip"
-        run_command(f'wget -O {jetbrains_zip} "{jetbrains_url}"')
-        extract_dir = os.path.join("/tmp", "jetbrains-mono")
+        run_command(["wget", "-O", jetbrains_zip, jetbrains_url])
+        extract_dir = os.path.join(STAGING_DIR, "jetbrains-mono")
         os.makedirs(extract_dir, exist_ok=True)
-        run_command(f"unzip -o {jetbrains_zip} -d {extract_dir}")
+        run_command(["unzip", "-o", jetbrains_zip, "-d", extract_dir])
         for root, _, files in os.walk(extract_dir):
             for file in files:
                 if file.lower().endswith((".ttf", ".otf")):
                     full_path = os.path.join(root, file)
                     shutil.copy(full_path, fonts_dir)
                     logg(f"Copied font '{file}' to fonts directory.", BLUE)
-        run_command("fc-cache -fv")
+        run_command(["fc-cache", "-fv"])
         logg("Font cache updated for JetBrains Mono.", GREEN)
     except Exception as e:
         logg(f"Error installing fonts: {e}", RED)
@@ -207,9 +339,10 @@ def install_docker():
     logg("Starting installation of Docker...", BLUE)
     try:
         # A deeper check could be done (e.g. check if docker daemon is running)
-        run_command("apt install -y docker.io")
-        run_command("systemctl enable --now docker")
-        run_command("usermod -aG docker $USER")
+        apt_install(["docker.io"])
+        run_command(["systemctl", "enable", "--now", "docker"], privileged=True)
+        user = os.environ.get("SUDO_USER") or os.environ.get("USER", "")
+        run_command(["usermod", "-aG", "docker", user], privileged=True)
         logg(
             "Docker installed successfully. Please log out/in to apply changes.", GREEN
         )
@@ -220,13 +353,21 @@ def install_docker():
 def install_aws_cli():
     logg("Starting installation of AWS CLI...", BLUE)
     try:
+        aws_zip = os.path.join(STAGING_DIR, "awscliv2.zip")
+        aws_dir = os.path.join(STAGING_DIR, "aws")
         run_command(
-            'curl -s "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip" -o "awscliv2.zip"'
+            [
+                "curl",
+                "-s",
+                "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip",
+                "-o",
+                aws_zip,
+            ]
         )
-        run_command("unzip awscliv2.zip")
-        run_command("./aws/install")
-        run_command("rm awscliv2.zip")
-        run_command("rm -rf aws")
+        run_command(["unzip", "-o", aws_zip, "-d", STAGING_DIR])
+        run_command([os.path.join(aws_dir, "install")], privileged=True)
+        os.remove(aws_zip)
+        shutil.rmtree(aws_dir, ignore_errors=True)
         logg("AWS CLI installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing AWS CLI: {e}", RED)
@@ -235,7 +376,8 @@ def install_aws_cli():
 def _update_rust_env():
     logg("Starting update of Rust environment...", BLUE)
     try:
-        rust_bin = os.path.expanduser("~/.cargo/bin")
+        cargo_home = os.environ.get("CARGO_HOME", os.path.expanduser("~/.cargo"))
+        rust_bin = os.path.join(cargo_home, "bin")
         if os.path.isdir(rust_bin):
             os.environ["PATH"] = f"{rust_bin}:" + os.environ["PATH"]
             logg("Rust environment updated successfully.", GREEN)
@@ -248,11 +390,18 @@ def _update_rust_env():
 def install_rust():
     logg("Starting installation of Rust...", BLUE)
     try:
-        run_command(
-            "curl --proto '=https' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- -y"
+        rustup_args = ["-y"]
+        if "CARGO_HOME" in os.environ:
+            # Building for the shared store: leave shell profiles alone
+            rustup_args.append("--no-modify-path")
+        run_pipeline(
+            [
+                ["curl", "--proto", "=https", "--tlsv1.2", "-sSf", "https://sh.rustup.rs"],
+                ["sh", "-s", "--", *rustup_args],
+            ]
         )
         _update_rust_env()
-        run_command("cargo install exa bat")
+        run_command(["cargo", "install", "exa", "bat"])
         logg("Rust and additional packages (exa, bat) installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing Rust: {e}", RED)
@@ -261,7 +410,9 @@ def install_rust():
 def install_uv():
     logg("Starting installation of UV (requires Rust)...", BLUE)
     try:
-        run_command("cargo install --git https://github.com/astral-sh/uv uv")
+        run_command(
+            ["cargo", "install", "--git", "https://github.com/astral-sh/uv", "uv"]
+        )
         logg("UV installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing UV: {e}", RED)
@@ -270,8 +421,8 @@ def install_uv():
 def install_node_pnpm():
     logg("Starting installation of Node.js, npm, and pnpm...", BLUE)
     try:
-        run_command("apt install -y nodejs npm")
-        run_command("npm install -g pnpm")
+        apt_install(["nodejs", "npm"])
+        run_command(["npm", "install", "-g", "pnpm"], privileged=True)
         logg("Node.js, npm, and pnpm installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing Node.js, npm, or pnpm: {e}", RED)
@@ -280,7 +431,7 @@ def install_node_pnpm():
 def install_golang():
     logg("Starting installation of Golang...", BLUE)
     try:
-        run_command("apt install -y golang-go")
+        apt_install(["golang-go"])
         logg("Golang installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing Golang: {e}", RED)
@@ -289,7 +440,7 @@ def install_golang():
 def install_btop():
     logg("Starting installation of btop...", BLUE)
     try:
-        run_command("apt install -y btop")
+        apt_install(["btop"])
         logg("btop installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing btop: {e}", RED)
@@ -299,8 +450,11 @@ def install_lazygit():
     logg("Starting installation of LazyGit...", BLUE)
     try:
         version_json = subprocess.check_output(
-            'curl -s "https://api.github.com/repos/jesseduffield/lazygit/releases/latest"',
-            shell=True,
+            [
+                "curl",
+                "-s",
+                "https://api.github.com/repos/jesseduffield/lazygit/releases/latest",
+            ]
         ).decode()
         match = re.search(r'"tag_name":\s*"v?([^"]+)"', version_json)
         if not match:
@@ -309,10 +463,15 @@ def install_lazygit():
         lazygit_version = match.group(1)
         url = f"https://github.com/jesseduffield/lazygit/releases/download/v{lazygit_version}/lazygit_{lazygit_version}_Linux_x86_64.tar.gz"
         logg(f"Downloading LazyGit v{lazygit_version}...", BLUE)
-        run_command(f"curl -Lo lazygit.tar.gz {url}")
-        run_command("tar xf lazygit.tar.gz lazygit")
-        run_command("install lazygit -D -t /usr/local/bin/")
-        run_command("rm lazygit lazygit.tar.gz")
+        lazygit_tar = os.path.join(STAGING_DIR, "lazygit.tar.gz")
+        lazygit_bin = os.path.join(STAGING_DIR, "lazygit")
+        run_command(["curl", "-Lo", lazygit_tar, url])
+        run_command(["tar", "xf", lazygit_tar, "-C", STAGING_DIR, "lazygit"])
+        run_command(
+            ["install", lazygit_bin, "-D", "-t", "/usr/local/bin/"], privileged=True
+        )
+        os.remove(lazygit_bin)
+        os.remove(lazygit_tar)
         logg("LazyGit installed successfully.", GREEN)
     except Exception as e:
         logg(f"Error installing LazyGit: {e}", RED)
@@ -321,8 +480,15 @@ def install_lazygit():
 def install_lazydocker():
     logg("Starting installation of lazydocker...", BLUE)
     try:
-        run_command(
-            "curl -s https://raw.githubusercontent.com/jesseduffield/lazydocker/master/scripts/install_update_linux.sh | bash"
+        run_pipeline(
+            [
+                [
+                    "curl",
+                    "-s",
+                    "https://raw.githubusercontent.com/jesseduffield/lazydocker/master/scripts/install_update_linux.sh",
+                ],
+                ["bash"],
+            ]
         )
         logg("lazydocker installed successfully.", GREEN)
     except Exception as e:
@@ -409,30 +575,321 @@ def set_zsh_plugins():
         logg(f"Error configuring plugins in .zshrc: {e}", RED)
 
 
-def main():
-    logg("Starting full configuration...", BLUE)
+def _store_component(name, src):
+    """
+    Add a freshly built component to the store, raising if the build is
+    incomplete (install steps log command failures instead of raising).
+    """
+    if not add_to_store(name, src, STORE_COMPONENTS[name]):
+        raise RuntimeError(f"'{name}' build is incomplete; the store was not updated.")
+
+
+def build_store():
+    """
+    Build the shared components (Oh My Zsh with plugins and theme, fonts, the
+    Rust toolchain and cargo binaries) once and add them to the store.
+    Components already in the store are reused.
+    """
+    logg("Starting build of the shared store...", BLUE)
+    try:
+        if not get_component("oh-my-zsh") or not get_component("fonts"):
+            build_home = os.path.join(STORE_BUILD_DIR, "home")
+            shutil.rmtree(build_home, ignore_errors=True)
+            os.makedirs(build_home)
+            set_user_home(build_home)
+            try:
+                if not get_component("oh-my-zsh"):
+                    install_oh_my_zsh()
+                    install_zsh_plugins()
+                    install_powerlevel10k()
+                    _store_component(
+                        "oh-my-zsh", os.path.join(build_home, ".oh-my-zsh")
+                    )
+                if not get_component("fonts"):
+                    install_fonts()
+                    fonts_dir = os.path.join(build_home, ".local", "share", "fonts")
+                    _store_component("fonts", fonts_dir)
+            finally:
+                set_user_home(None)
+            shutil.rmtree(build_home, ignore_errors=True)
+
+        if not get_component("rustup") or not get_component("cargo-bin"):
+            rustup_home = os.path.join(STORE_BUILD_DIR, "rustup")
+            cargo_home = os.path.join(STORE_BUILD_DIR, "cargo")
+            shutil.rmtree(rustup_home, ignore_errors=True)
+            shutil.rmtree(cargo_home, ignore_errors=True)
+            os.environ["RUSTUP_HOME"] = rustup_home
+            os.environ["CARGO_HOME"] = cargo_home
+            try:
+                install_rust()
+                install_uv()
+            finally:
+                del os.environ["RUSTUP_HOME"]
+                del os.environ["CARGO_HOME"]
+            try:
+                _store_component("rustup", rustup_home)
+                _store_component("cargo-bin", os.path.join(cargo_home, "bin"))
+            finally:
+                # Registry and git checkouts are build-time only
+                shutil.rmtree(cargo_home, ignore_errors=True)
+        logg("Shared store is up to date.", GREEN)
+    except Exception as e:
+        logg(f"Error building the shared store: {e}", RED)
+
+
+def _write_store_block(path, lines):
+    """
+    Add (or refresh) the shared store block at the top of a user's shell
+    startup file, creating the file if needed.
+    """
+    block = "\n".join([STORE_BLOCK_BEGIN, *lines, STORE_BLOCK_END]) + "\n"
+    content = ""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            content = f.read()
+    if STORE_BLOCK_BEGIN in content and STORE_BLOCK_END in content:
+        before, rest = content.split(STORE_BLOCK_BEGIN, 1)
+        after = rest.split(STORE_BLOCK_END, 1)[1]
+        content = before + block + after.removeprefix("\n")
+    else:
+        content = block + content
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _link_user_home(home, components):
+    """
+    Link `home` to the stored components and write its startup files.
+    Runs as the target user (see run_as_user), never as root.
+    """
+    links = [
+        ("oh-my-zsh", link_path, ".oh-my-zsh"),
+        ("rustup", link_path, ".rustup"),
+        ("fonts", link_tree, os.path.join(".local", "share", "fonts")),
+        ("cargo-bin", link_tree, os.path.join(".cargo", "bin")),
+    ]
+    for name, link, rel in links:
+        link(components[name], os.path.join(home, rel))
+        logg(f"Linked '{name}' into {home}.", BLUE)
+    os.makedirs(os.path.join(home, ".cache", "oh-my-zsh"), exist_ok=True)
+
+    zshrc = os.path.join(home, ".zshrc")
+    if not os.path.lexists(zshrc):
+        ohmyzsh = components["oh-my-zsh"]
+        template = os.path.join(ohmyzsh, "templates", "zshrc.zsh-template")
+        shutil.copyfile(template, zshrc)
+    set_user_home(home)
     try:
-        update_upgrade()
-        install_packages()
-        install_basic_tools()
-        change_default_shell()
-        install_oh_my_zsh()
-        install_zsh_plugins()
-        install_powerlevel10k()
-        install_fonts()
-        # Uncomment if Docker installation is required
-        # install_docker()
-        install_aws_cli()
-        install_rust()
-        install_node_pnpm()
-        install_golang()
-        install_uv()
-        install_btop()
-        install_lazygit()
-        install_lazydocker()
         configure_aliases()
         set_zsh_plugins()
         set_powerlevel10k_theme()
+    finally:
+        set_user_home(None)
+    # Runs before Oh My Zsh is sourced further down in .zshrc
+    _write_store_block(
+        zshrc,
+        [
+            'export ZSH_CACHE_DIR="$HOME/.cache/oh-my-zsh"',
+            'DISABLE_AUTO_UPDATE="true"',
+        ],
+    )
+    # ~/.zshenv is read by every zsh (including `zsh -c`), ~/.profile by
+    # login shells and desktop sessions
+    path_line = 'export PATH="$HOME/.cargo/bin:$PATH"'
+    for startup_file in (".zshenv", ".profile"):
+        _write_store_block(os.path.join(home, startup_file), [path_line])
+
+
+def provision_user(user):
+    """
+    Link a user's home to the shared store. Only shell startup files and cache
+    directories are per-user; everything else is a hardlink or symlink into the
+    store. ~/.rustup is a symlink to the stored toolchain, so the rustup proxies
+    in ~/.cargo/bin work in any session without RUSTUP_HOME being set.
+
+    Everything under the home is written with the user's own privileges, since
+    the user controls what its paths point to. Returns True on success.
+    """
+    logg(f"Starting provisioning of user '{user}' from the shared store...", BLUE)
+    try:
+        home = pwd.getpwnam(user).pw_dir
+        components = {name: get_component(name) for name in STORE_COMPONENTS}
+        missing = [name for name, path in components.items() if not path]
+        if missing:
+            logg(
+                f"Shared store is missing {', '.join(missing)}. Skipping user '{user}'.",
+                RED,
+            )
+            return False
+        if not run_as_user(user, _link_user_home, home, components):
+            logg(f"Error linking the home of user '{user}'.", RED)
+            return False
+        run_command(["chsh", "-s", shutil.which("zsh"), user], privileged=True)
+        logg(f"User '{user}' provisioned successfully.", GREEN)
+        return True
+    except KeyError:
+        logg(f"User '{user}' does not exist. Skipping.", RED)
+    except Exception as e:
+        logg(f"Error provisioning user '{user}': {e}", RED)
+    return False
+
+
+def provision_users():
+    for user in USERS:
+        if not provision_user(user):
+            FAILED_USERS.append(user)
+
+
+def get_timings_path():
+    return os.path.join(get_user_home(), ".cache", "ubuntu-env-conf", "timings.json")
+
+
+def get_timings_key(profile):
+    """Timings of --users runs are kept apart from single-user runs."""
+    return f"{profile}-users" if USERS else profile
+
+
+def report_time_saved(timings, baseline_path=None):
+    """
+    Compare this run's step timings with a recorded default-profile run of the
+    same mode, read from `baseline_path` (e.g. cached by CI) or from this host's
+    timings file.
+    """
+    current = timings.get(get_timings_key(PROFILE), {})
+    if PROFILE == DEFAULT_PROFILE:
+        logg(f"Total time: {sum(current.values()):.1f}s.", BLUE)
+        return
+    source = baseline_path or get_timings_path()
+    baseline = load_timings(source).get(get_timings_key(DEFAULT_PROFILE))
+    if not baseline:
+        logg(
+            f"Total time: {sum(current.values()):.1f}s. No default-profile timings "
+            f"found in {source}; pass --baseline-timings with the timings.json of a "
+            f"--profile={DEFAULT_PROFILE} run to compare.",
+            YELLOW,
+        )
+        return
+    steps = [step for step in current if step in baseline]
+    difference = sum(baseline[step] - current[step] for step in steps)
+    comparison = "faster" if difference >= 0 else "slower"
+    logg(
+        f"Profile '{PROFILE}' was {abs(difference):.1f}s {comparison} than the "
+        f"default-profile run recorded in {source}, across {len(steps)} steps.",
+        GREEN,
+    )
+    for step in steps:
+        logg(f"  {step}: {baseline[step] - current[step]:+.1f}s", BLUE)
+    if not baseline_path:
+        logg(
+            "The baseline was recorded on this host, so steps that skipped "
+            "already-installed tools count towards the difference. Use "
+            "--baseline-timings with a fresh host's default run for a "
+            "like-for-like comparison.",
+            YELLOW,
+        )
+
+
+def run_steps(steps):
+    """Run each step and return a mapping of step name to elapsed seconds."""
+    timings = {}
+    for step in steps:
+        start = time.monotonic()
+        step()
+        timings[step.__name__] = round(time.monotonic() - start, 2)
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Set up the development environment.")
+    parser.add_argument(
+        "--profile",
+        choices=PROFILES,
+        default=DEFAULT_PROFILE,
+        help="'ephemeral' skips crash-safety and docs for throwaway hosts.",
+    )
+    parser.add_argument(
+        "--baseline-timings",
+        metavar="PATH",
+        help="timings.json of a default-profile run (e.g. cached by CI) to compare "
+        "the ephemeral profile against.",
+    )
+    parser.add_argument(
+        "--users",
+        help="Comma-separated users to provision from the shared store in /opt "
+        "(requires root).",
+    )
+    args = parser.parse_args()
+    if args.users is not None:
+        args.users = [user.strip() for user in args.users.split(",") if user.strip()]
+        if not args.users:
+            parser.error("--users needs at least one user name.")
+    return args
+
+
+def main():
+    args = parse_args()
+    logg("Starting full configuration...", BLUE)
+    try:
+        configure_profile(args.profile)
+        if args.users:
+            if os.geteuid() != 0:
+                logg("Multi-user provisioning must run as root (sudo).", RED)
+                sys.exit(1)
+            USERS.extend(args.users)
+            if all(get_component(name) for name in STORE_COMPONENTS):
+                # System packages were installed when the store was built
+                logg("Shared store is complete. Only linking users.", BLUE)
+                steps = [provision_users]
+            else:
+                steps = [
+                    update_upgrade,
+                    install_packages,
+                    install_basic_tools,
+                    install_aws_cli,
+                    install_node_pnpm,
+                    install_golang,
+                    install_btop,
+                    install_lazygit,
+                    build_store,
+                    provision_users,
+                ]
+        else:
+            steps = [
+                update_upgrade,
+                install_packages,
+                install_basic_tools,
+                change_default_shell,
+                install_oh_my_zsh,
+                install_zsh_plugins,
+                install_powerlevel10k,
+                install_fonts,
+                # Uncomment if Docker installation is required
+                # install_docker,
+                install_aws_cli,
+                install_rust,
+                install_node_pnpm,
+                install_golang,
+                install_uv,
+                install_btop,
+                install_lazygit,
+                install_lazydocker,
+                configure_aliases,
+                set_zsh_plugins,
+                set_powerlevel10k_theme,
+            ]
+        timings_path = get_timings_path()
+        timings = load_timings(timings_path)
+        timings[get_timings_key(PROFILE)] = run_steps(steps)
+        save_timings(timings_path, timings)
+        report_time_saved(timings, args.baseline_timings)
+        if USERS:
+            missing = [name for name in STORE_COMPONENTS if not get_component(name)]
+            if missing:
+                logg(f"Shared store is incomplete: {', '.join(missing)}.", RED)
+                sys.exit(1)
+            if FAILED_USERS:
+                logg(f"Could not provision: {', '.join(FAILED_USERS)}.", RED)
+                sys.exit(1)
         logg("Configuration completed successfully!", GREEN)
     except subprocess.CalledProcessError as e:
         logg(f"An error occurred while executing a command: {e.cmd}", RED)
@@ -440,6 +897,8 @@ def main():
     except Exception as e:
         logg(f"Configuration failed: {e}", RED)
         sys.exit(1)
+    finally:
+        cleanup_staging()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+
+from constants import (
+    GREEN,
+    BLUE,
+    RED,
+    YELLOW,
+    STORE_DIR,
+    STORE_MANIFEST,
+)
+from utils import logg
+
+
+def _tree_entries(path, rel=""):
+    """
+    Yield (relative path, DirEntry) for everything under `path`, sorted by name
+    and without following symlinks.
+    """
+    with os.scandir(os.path.join(path, rel)) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        entry_rel = os.path.join(rel, entry.name)
+        yield entry_rel, entry
+        if entry.is_dir(follow_symlinks=False):
+            yield from _tree_entries(path, entry_rel)
+
+
+def hash_tree(path):
+    """
+    Return a sha256 digest of a directory tree: names, symlink targets,
+    executable bits and file contents.
+    """
+    digest = hashlib.sha256()
+    for rel, entry in _tree_entries(path):
+        digest.update(rel.encode() + b"\0")
+        if entry.is_symlink():
+            digest.update(b"l" + os.readlink(entry.path).encode() + b"\0")
+        elif entry.is_dir():
+            digest.update(b"d\0")
+        else:
+            executable = entry.stat().st_mode & stat.S_IXUSR
+            digest.update(b"x\0" if executable else b"f\0")
+            with open(entry.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_only_mode(mode):
+    """
+    Drop the write bits and add a+rX, so the store is readable by every user
+    whatever root's umask was during the build.
+    """
+    mode |= 0o444
+    if stat.S_ISDIR(mode) or mode & 0o111:
+        mode |= 0o111
+    return mode & ~0o222
+
+
+def _make_read_only(path):
+    for _, entry in _tree_entries(path):
+        if not entry.is_symlink():
+            mode = entry.stat(follow_symlinks=False).st_mode
+            os.chmod(entry.path, _read_only_mode(mode))
+    os.chmod(path, _read_only_mode(os.stat(path).st_mode))
+
+
+def _make_store_dirs():
+    """Create STORE_DIR and make it and its parent traversable by every user."""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    for directory in (os.path.dirname(STORE_DIR), STORE_DIR):
+        os.chmod(directory, os.stat(directory).st_mode | 0o755)
+
+
+def load_manifest():
+    """Load the mapping of component name to store path, or an empty dict."""
+    try:
+        with open(STORE_MANIFEST, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_component(name):
+    """Return the store path of a component, or None if it was never stored."""
+    path = load_manifest().get(name)
+    if path and os.path.isdir(path):
+        return path
+    return None
+
+
+def _is_present(path):
+    """True for a non-empty file or a non-empty directory."""
+    if os.path.isdir(path):
+        return bool(os.listdir(path))
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+def add_to_store(name, src, required=()):
+    """
+    Move the directory `src` into the store under its content digest, make it
+    read-only and record it in the manifest. Identical content is stored once.
+
+    Every path in `required` (relative to `src`) must be a non-empty file or
+    directory; otherwise the build is discarded and the manifest is left as is.
+    """
+    if not os.path.isdir(src):
+        logg(f"Cannot add '{name}' to the store: {src} not found.", RED)
+        return None
+    missing = [rel for rel in required if not _is_present(os.path.join(src, rel))]
+    if missing:
+        logg(
+            f"Cannot add '{name}' to the store: missing or empty {', '.join(missing)}.",
+            RED,
+        )
+        shutil.rmtree(src, ignore_errors=True)
+        return None
+    logg(f"Adding '{name}' to the shared store...", BLUE)
+    _make_store_dirs()
+    dest = os.path.join(STORE_DIR, f"{hash_tree(src)}-{name}")
+    if os.path.isdir(dest):
+        logg(f"'{name}' already in the store at {dest}.", YELLOW)
+        shutil.rmtree(src)
+    else:
+        os.rename(src, dest)
+    # Also fixes permissions of entries stored under a strict umask earlier
+    _make_read_only(dest)
+    manifest = load_manifest()
+    manifest[name] = dest
+    with open(STORE_MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.chmod(STORE_MANIFEST, 0o644)
+    logg(f"'{name}' stored at {dest}.", GREEN)
+    return dest
+
+
+def link_tree(src, dest):
+    """
+    Recreate the store tree `src` under `dest` as hardlinks to the store files,
+    falling back to symlinks where the kernel refuses the hardlink (e.g.
+    protected_hardlinks or another filesystem). Existing files are left
+    untouched. Meant to run as the target user (see utils.run_as_user).
+    """
+    os.makedirs(dest, exist_ok=True)
+    for rel, entry in _tree_entries(src):
+        target = os.path.join(dest, rel)
+        if entry.is_dir(follow_symlinks=False):
+            os.makedirs(target, exist_ok=True)
+            continue
+        if os.path.lexists(target):
+            continue
+        if entry.is_symlink():
+            os.symlink(os.readlink(entry.path), target)
+        else:
+            try:
+                os.link(entry.path, target)
+            except OSError:
+                os.symlink(entry.path, target)
+
+
+def link_path(src, dest):
+    """Point `dest` at the store path `src` with a single symlink."""
+    if os.path.islink(dest):
+        if os.readlink(dest) == src:
+            return
+        os.remove(dest)
+    elif os.path.exists(dest):
+        logg(f"{dest} exists and is not a store link. Skipping.", YELLOW)
+        return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.symlink(src, dest)
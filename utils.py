@@ -1,6 +1,11 @@
+import atexit
+import json
 import os
+import pwd
+import shlex
 import subprocess
 import shutil
+import sys
 
 from constants import (
     GREEN,
@@ -16,22 +21,17 @@ def logg(message, color=BLUE):
     print(f"{color}{message}{RESET}")
 
 
-def check_command(cmd, description):
+def check_command(argv, description):
     """
-    Executa um comando e, se concluir sem erro, considera o teste bem-sucedido.
+    Executa um comando (lista argv, sem shell) e, se concluir sem erro,
+    considera o teste bem-sucedido.
     """
     try:
-        logg(f"Testando: {description}\n  Comando: {cmd}", BLUE)
-        subprocess.run(
-            cmd,
-            shell=True,
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        logg(f"Testando: {description}\n  Comando: {shlex.join(argv)}", BLUE)
+        _run(argv)
         logg(f"Sucesso: {description}", GREEN)
         return True
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, OSError):
         logg(f"Falha: {description}", RED)
         return False
 
@@ -67,22 +67,146 @@ def clone_repo(repo_url, dest):
     if os.path.exists(dest):
         logg(f"The directory {dest} already exists, skipping clone.", YELLOW)
     else:
-        run_command(f"git clone {repo_url} {dest}")
+        run_command(["git", "clone", repo_url, dest])
+
+
+def _resolve_argv(argv, env=None):
+    """
+    Resolve argv[0] to an absolute path so subprocess can use posix_spawn.
+    """
+    path = (env or os.environ).get("PATH")
+    executable = shutil.which(argv[0], path=path) if os.sep not in argv[0] else None
+    if executable:
+        return [executable, *argv[1:]]
+    return list(argv)
+
+
+def _run(argv, env=None):
+    """
+    Exec argv directly (no shell) with output suppressed.
+    close_fds=False lets CPython use posix_spawn instead of fork/exec.
+    """
+    subprocess.run(
+        _resolve_argv(argv, env),
+        check=True,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,  # Suppress stdout
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+    )
+
+
+_privileged_helper = None
+
+
+def _close_privileged_helper():
+    if _privileged_helper and _privileged_helper.poll() is None:
+        _privileged_helper.stdin.close()
+        _privileged_helper.wait()
+
+
+atexit.register(_close_privileged_helper)
+
+
+def _get_privileged_helper():
+    """
+    Start (once) a root helper through sudo that runs argv lists sent over stdin,
+    so each privileged command does not pay for its own sudo startup.
+    """
+    global _privileged_helper
+    if _privileged_helper is None or _privileged_helper.poll() is not None:
+        _privileged_helper = subprocess.Popen(
+            ["sudo", sys.executable, os.path.abspath(__file__), "--privileged-helper"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+    return _privileged_helper
+
+
+def _run_privileged(argv, env=None):
+    if os.geteuid() == 0:
+        _run(argv, env=env)
+        return
+    helper = _get_privileged_helper()
+    helper.stdin.write(json.dumps({"argv": list(argv), "env": env}) + "\n")
+    helper.stdin.flush()
+    response = helper.stdout.readline()
+    if not response:
+        raise RuntimeError("Privileged helper exited unexpectedly.")
+    returncode = json.loads(response)["returncode"]
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, argv)
 
 
-def run_command(cmd, env=None):
+def _privileged_helper_loop():
+    """Serve requests from _run_privileged() until stdin is closed."""
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            _run(request["argv"], env=request["env"])
+            returncode = 0
+        except subprocess.CalledProcessError as e:
+            returncode = e.returncode
+        except OSError:
+            returncode = 127
+        sys.stdout.write(json.dumps({"returncode": returncode}) + "\n")
+        sys.stdout.flush()
+
+
+def run_command(argv, env=None, privileged=False):
+    """
+    Run a command given as an argv list, without a shell.
+    Privileged commands go through the shared root helper when not already root.
+    """
+    cmd = shlex.join(argv)
     try:
         logg(f"Running: {cmd}", GREY)
-        subprocess.run(
-            cmd,
-            shell=True,
-            check=True,
-            env=env,
-            stdout=subprocess.DEVNULL,  # Suppress stdout
-            stderr=subprocess.DEVNULL,
-        )
+        if privileged:
+            _run_privileged(argv, env=env)
+        else:
+            _run(argv, env=env)
+
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logg(f"Command failed: {cmd}", RED)
+        logg(f"Error: {e}", RED)
+
+    except Exception as e:
+        logg(f"Unexpected error: {e}", RED)
+        raise
 
-    except subprocess.CalledProcessError as e:
+
+def run_pipeline(commands, env=None):
+    """
+    Run an explicit pipeline of argv lists, e.g. curl feeding sh, without a shell.
+    Fails if any stage exits non-zero (like `set -o pipefail`).
+    """
+    cmd = " | ".join(shlex.join(argv) for argv in commands)
+    try:
+        logg(f"Running: {cmd}", GREY)
+        processes = []
+        stdin = subprocess.DEVNULL
+        for i, argv in enumerate(commands):
+            last = i == len(commands) - 1
+            process = subprocess.Popen(
+                _resolve_argv(argv, env),
+                env=env,
+                stdin=stdin,
+                stdout=subprocess.DEVNULL if last else subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                close_fds=False,
+            )
+            if processes:
+                # Let the previous stage get SIGPIPE if this one exits early
+                processes[-1].stdout.close()
+            processes.append(process)
+            stdin = process.stdout
+        for argv, process in zip(commands, processes):
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, argv)
+
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
         logg(f"Command failed: {cmd}", RED)
         logg(f"Error: {e}", RED)
 
@@ -91,10 +215,119 @@ def run_command(cmd, env=None):
         raise
 
 
+def run_as_user(user, func, *args):
+    """
+    Run func(*args) in a forked child that has dropped root to `user`'s uid,
+    gid and groups, so anything it writes in that user's home (including
+    through symlinks the user planted) is limited to the user's own rights.
+    Returns True if func completed without raising.
+    """
+    entry = pwd.getpwnam(user)
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.initgroups(user, entry.pw_gid)
+            os.setgid(entry.pw_gid)
+            os.setuid(entry.pw_uid)
+            os.environ["HOME"] = entry.pw_dir
+            os.environ["USER"] = user
+            func(*args)
+            code = 0
+        except Exception as e:
+            logg(f"Error running as user '{user}': {e}", RED)
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+_user_home_override = None
+
+
+def set_user_home(home):
+    """
+    Make get_user_home() return `home` (used to provision other users or the
+    shared store). Pass None to go back to the invoking user.
+    """
+    global _user_home_override
+    _user_home_override = home
+
+
 def get_user_home():
     """Get the home directory of the user who invoked sudo."""
+    if _user_home_override:
+        return _user_home_override
     sudo_user = os.environ.get("SUDO_USER")
     if sudo_user:
         return os.path.expanduser(f"~{sudo_user}")
 
     return os.path.expanduser("~")
+
+
+def get_available_memory():
+    """Return the available RAM in bytes as reported by /proc/meminfo, or 0."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def get_tmpfs_dir(path, min_free_bytes):
+    """
+    Return `path` if it is writable and both it and the system have at least
+    `min_free_bytes` free, otherwise None.
+    """
+    if not os.path.isdir(path) or not os.access(path, os.W_OK):
+        return None
+    stats = os.statvfs(path)
+    if stats.f_bavail * stats.f_frsize < min_free_bytes:
+        return None
+    if get_available_memory() < min_free_bytes:
+        return None
+    return path
+
+
+def load_timings(path):
+    """Load recorded step timings per profile, or an empty dict."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _chown_to_invoking_user(path):
+    """Under sudo, give `path` back to the user who invoked sudo."""
+    uid = os.environ.get("SUDO_UID")
+    gid = os.environ.get("SUDO_GID")
+    if os.geteuid() == 0 and uid and gid:
+        os.chown(path, int(uid), int(gid))
+
+
+def save_timings(path, timings):
+    """
+    Write timings to `path`. Directories it creates (e.g. ~/.cache) and the file
+    itself are owned by the invoking user, not root.
+    """
+    missing = []
+    directory = os.path.dirname(path)
+    while not os.path.isdir(directory):
+        missing.append(directory)
+        directory = os.path.dirname(directory)
+    for directory in reversed(missing):
+        os.mkdir(directory)
+        _chown_to_invoking_user(directory)
+    with open(path, "w") as f:
+        json.dump(timings, f, indent=2)
+    _chown_to_invoking_user(path)
+
+
+if __name__ == "__main__" and sys.argv[1:] == ["--privileged-helper"]:
+    _privileged_helper_loop()